@@ -89,7 +89,8 @@ class Config:
 
 
 # pickle.dump protocol version: https://docs.python.org/3/library/pickle.html#data-stream-format
-PROTOCOL_VERSION = 4
+# Protocol 5 (Python>=3.8) writes the buffers of numpy arrays (e.g. the blocks of a DataFrame) without an extra copy.
+PROTOCOL_VERSION = 5
 
 NUM_USABLE_CPU = max(multiprocessing.cpu_count() - 2, 1)
 
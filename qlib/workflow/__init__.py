@@ -513,6 +513,8 @@ class QlibRecorder:
         **kwargs: Dict[Text, Any]
             the object to be saved.
             For example, `{"pred.pkl": pred}`
+            Numpy arrays (except arrays of objects) whose names end with `.npy` (e.g. `{"pred.npy": arr}`) are saved
+            in the npy format, which is faster to save and load. Other objects are pickled.
         """
         if local_path is not None and len(kwargs) > 0:
             raise ValueError(
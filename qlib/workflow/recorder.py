@@ -3,26 +3,47 @@
 
 import os
 import sys
+import time
 from typing import Optional
 import mlflow
+import numpy as np
 import shutil
 import pickle
 import tempfile
 import subprocess
 import platform
+import concurrent.futures
 from pathlib import Path
 from datetime import datetime
+from collections import OrderedDict, deque
+from itertools import chain
 
 from qlib.utils.serial import Serializable
 from qlib.utils.exceptions import LoadObjectError
 from qlib.utils.paral import AsyncCaller
 
 from ..log import TimeInspector, get_module_logger
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.exceptions import MlflowException
 from mlflow.store.artifact.azure_blob_artifact_repo import AzureBlobArtifactRepository
+from mlflow.utils.validation import MAX_METRICS_PER_BATCH, MAX_PARAMS_TAGS_PER_BATCH
+from mlflow.utils.validation import _validate_metric, _validate_param, _validate_tag
 
 logger = get_module_logger("workflow")
 # mlflow limits the length of log_param to 500, but this caused errors when using qrun, so we extended the mlflow limit.
-mlflow.utils.validation.MAX_PARAM_VAL_LENGTH = 1000
+# Newer versions of mlflow have a higher limit, which should not be lowered.
+mlflow.utils.validation.MAX_PARAM_VAL_LENGTH = max(mlflow.utils.validation.MAX_PARAM_VAL_LENGTH, 1000)
+# buffer size of the files of objects read by `load_object` and of the npy files written by `save_objects`.
+# NOTE: pickles are written without an extra buffer (e.g. `io.BufferedWriter`). With protocol >= 4 the pickler already
+# writes in 64KiB frames and writes large buffers (e.g. numpy arrays) directly, so an extra buffer only adds copies.
+IO_BUFFER_SIZE = 1 << 20
+# max number of threads to send requests concurrently (e.g. uploading artifacts, deleting tags)
+MAX_REQUEST_WORKERS = 8
+
+
+def _format_time(dt: datetime) -> str:
+    # same as `dt.strftime("%Y-%m-%d %H:%M:%S")` but skips the locale machinery of strftime
+    return dt.isoformat(sep=" ", timespec="seconds")
 
 
 class Recorder:
@@ -38,6 +59,9 @@ class Recorder:
     STATUS_R = "RUNNING"
     STATUS_FI = "FINISHED"
     STATUS_FA = "FAILED"
+    _VALID_STATUS = frozenset({STATUS_S, STATUS_R, STATUS_FI, STATUS_FA})
+
+    __slots__ = ("id", "name", "experiment_id", "start_time", "end_time", "status", "recorder_name")
 
     def __init__(self, experiment_id, name):
         self.id = None
@@ -54,19 +78,39 @@ class Recorder:
         return str(self.info)
 
     def __hash__(self) -> int:
-        return hash(self.info["id"])
+        return hash(self.id)
+
+    def __getstate__(self) -> dict:
+        # keep the state as a plain dict (the same as the recorders pickled before `__slots__` was introduced)
+        state = dict(getattr(self, "__dict__", {}))
+        for cls in type(self).__mro__:
+            for key in getattr(cls, "__slots__", ()):
+                if hasattr(self, key):
+                    state[key] = getattr(self, key)
+        return state
+
+    def __setstate__(self, state: dict):
+        unknown = []
+        for key, value in state.items():
+            try:
+                setattr(self, key, value)
+            except AttributeError:
+                # e.g. the attributes set on the recorders pickled before `__slots__` was introduced
+                unknown.append(key)
+        if len(unknown) > 0:
+            logger.warning(f"The unknown attributes {unknown} of the pickled {self.__class__.__name__} are dropped.")
 
     @property
     def info(self):
-        output = dict()
-        output["class"] = "Recorder"
-        output["id"] = self.id
-        output["name"] = self.name
-        output["experiment_id"] = self.experiment_id
-        output["start_time"] = self.start_time
-        output["end_time"] = self.end_time
-        output["status"] = self.status
-        return output
+        return {
+            "class": "Recorder",
+            "id": self.id,
+            "name": self.name,
+            "experiment_id": self.experiment_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "status": self.status,
+        }
 
     def set_recorder_name(self, rname):
         self.recorder_name = rname
@@ -260,10 +304,20 @@ class MLflowRecorder(Recorder):
         - User can control several different runs by just creating different Recorder (in mlflow, you always have to switch artifact_uri and pass in run ids frequently)
     """
 
+    __slots__ = ("_uri", "_artifact_uri", "client", "async_log", "_log_buffer", "_artifact_cache")
+
+    # max number of downloaded artifacts kept by the cache of `load_object`
+    ARTIFACT_CACHE_SIZE = 128
+
     def __init__(self, experiment_id, uri, name=None, mlflow_run=None):
         super(MLflowRecorder, self).__init__(experiment_id, name)
         self._uri = uri
         self._artifact_uri = None
+        # NOTE: no HTTP session is managed here. mlflow's REST store sends requests through a pooled
+        # `requests.Session` that is cached per process, so the connections to the tracking server are kept alive
+        # and reused across requests (the pool can be tuned by `MLFLOW_HTTP_POOL_CONNECTIONS/MAXSIZE`).
+        # For the same reason the client is not cached per uri: all the clients of a process already share the
+        # connections and creating a client is cheap (please refer to tests/dependency_tests/test_mlflow.py).
         self.client = mlflow.tracking.MlflowClient(tracking_uri=self._uri)
         # construct from mlflow run
         if mlflow_run is not None:
@@ -272,17 +326,23 @@ class MLflowRecorder(Recorder):
             self.id = mlflow_run.info.run_id
             self.status = mlflow_run.info.status
             self.start_time = (
-                datetime.fromtimestamp(float(mlflow_run.info.start_time) / 1000.0).strftime("%Y-%m-%d %H:%M:%S")
+                _format_time(datetime.fromtimestamp(float(mlflow_run.info.start_time) / 1000.0))
                 if mlflow_run.info.start_time is not None
                 else None
             )
             self.end_time = (
-                datetime.fromtimestamp(float(mlflow_run.info.end_time) / 1000.0).strftime("%Y-%m-%d %H:%M:%S")
+                _format_time(datetime.fromtimestamp(float(mlflow_run.info.end_time) / 1000.0))
                 if mlflow_run.info.end_time is not None
                 else None
             )
             self._artifact_uri = mlflow_run.info.artifact_uri
         self.async_log = None
+        # metrics, params and tags waiting to be sent by `_flush_log`.
+        # deque is used because its `append` and `popleft` are thread-safe and it keeps the recorder picklable.
+        self._log_buffer = deque()
+        # LRU cache of artifact name -> local path of the downloaded artifact for `load_object(..., use_cache=True)`.
+        # It is cleared when the artifacts are changed by this recorder.
+        self._artifact_cache = OrderedDict()
 
     def __repr__(self):
         name = self.__class__.__name__
@@ -297,13 +357,27 @@ class MLflowRecorder(Recorder):
         )
 
     def __hash__(self) -> int:
-        return hash(self.info["id"])
+        return hash(self.id)
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, MLflowRecorder):
-            return self.info["id"] == o.info["id"]
+            return self.id == o.id
         return False
 
+    def __getstate__(self) -> dict:
+        # The buffered logs and cached downloads belong to this process; the unpickled recorder must neither flush the
+        # logs again nor reuse the local files.
+        state = super().__getstate__()
+        state.pop("_log_buffer", None)
+        state.pop("_artifact_cache", None)
+        return state
+
+    def __setstate__(self, state: dict):
+        super().__setstate__(state)
+        # the recorders pickled by previous versions don't have these attributes
+        self._log_buffer = deque()
+        self._artifact_cache = OrderedDict()
+
     @property
     def uri(self):
         return self._uri
@@ -340,7 +414,7 @@ class MLflowRecorder(Recorder):
         # save the run id and artifact_uri
         self.id = run.info.run_id
         self._artifact_uri = run.info.artifact_uri
-        self.start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.start_time = _format_time(datetime.now())
         self.status = Recorder.STATUS_R
         logger.info(f"Recorder {self.id} starts running under Experiment {self.experiment_id} ...")
 
@@ -378,13 +452,8 @@ class MLflowRecorder(Recorder):
                 logger.info(f"Fail to log the uncommitted code of $CWD({os.getcwd()}) when run {cmd}.")
 
     def end_run(self, status: str = Recorder.STATUS_S):
-        assert status in [
-            Recorder.STATUS_S,
-            Recorder.STATUS_R,
-            Recorder.STATUS_FI,
-            Recorder.STATUS_FA,
-        ], f"The status type {status} is not supported."
-        self.end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        assert status in Recorder._VALID_STATUS, f"The status type {status} is not supported."
+        self.end_time = _format_time(datetime.now())
         if self.status != Recorder.STATUS_S:
             self.status = status
         if self.async_log is not None:
@@ -392,10 +461,12 @@ class MLflowRecorder(Recorder):
             with TimeInspector.logt("waiting `async_log`"):
                 self.async_log.wait()
         self.async_log = None
+        self._artifact_cache.clear()
         mlflow.end_run(status)
 
     def save_objects(self, local_path=None, artifact_path=None, **kwargs):
         assert self.uri is not None, "Please start the experiment and recorder first before using recorder directly."
+        self._artifact_cache.clear()
         if local_path is not None:
             path = Path(local_path)
             if path.is_dir():
@@ -403,21 +474,58 @@ class MLflowRecorder(Recorder):
             else:
                 self.client.log_artifact(self.id, local_path, artifact_path)
         else:
-            temp_dir = Path(tempfile.mkdtemp()).resolve()
-            for name, data in kwargs.items():
-                path = temp_dir / name
-                Serializable.general_dump(data, path)
-                self.client.log_artifact(self.id, temp_dir / name, artifact_path)
-            shutil.rmtree(temp_dir)
+            # the temporary directory is removed even if dumping or uploading fails
+            with tempfile.TemporaryDirectory() as temp_dir:
+                temp_dir = Path(temp_dir).resolve()
+                for name, data in kwargs.items():
+                    self._dump_object(data, temp_dir / name)
+                if len(kwargs) <= 1:
+                    # no need to start a thread for a single object
+                    for name in kwargs:
+                        self.client.log_artifact(self.id, temp_dir / name, artifact_path)
+                else:
+                    # Most artifact repositories upload the files of a directory one by one.
+                    # So the files are uploaded concurrently to make use of the bandwidth.
+                    with concurrent.futures.ThreadPoolExecutor(
+                        max_workers=min(MAX_REQUEST_WORKERS, len(kwargs))
+                    ) as executor:
+                        futures = [
+                            executor.submit(self.client.log_artifact, self.id, temp_dir / name, artifact_path)
+                            for name in kwargs
+                        ]
+                        for future in futures:
+                            future.result()
+
+    @staticmethod
+    def _dump_object(data, path: Path):
+        if path.suffix == ".npy" and type(data) is np.ndarray and not data.dtype.hasobject:
+            # The npy format writes the buffer of the array directly instead of copying it into a pickle.
+            # It is only used when the artifact is named so; the other artifacts (e.g. `pred.pkl`) are still pickles.
+            # Arrays of objects are pickled, so that they are always loaded by the unpickler given by the user.
+            with path.open("wb", buffering=IO_BUFFER_SIZE) as f:
+                np.save(f, data)
+        else:
+            Serializable.general_dump(data, path)
 
-    def load_object(self, name, unpickler=pickle.Unpickler):
+    def load_object(self, name, unpickler=pickle.Unpickler, use_cache: bool = False):
         """
         Load object such as prediction file or model checkpoint in mlflow.
 
+        Numpy arrays saved in the npy format (detected by the leading bytes of the file) are loaded by `np.load`.
+        Other files are loaded by the unpickler.
+
         Args:
             name (str): the object name
 
-            unpickler: Supporting using custom unpickler
+            unpickler: Supporting using custom unpickler. It is not needed for numpy arrays saved in the npy format,
+                which never contain pickles.
+
+            use_cache (bool): reuse the file downloaded by a previous `load_object(name, use_cache=True)` of this
+                recorder instead of downloading it again (e.g. when loading the same artifact in evaluation loops).
+                The cache keeps the latest `ARTIFACT_CACHE_SIZE` files.
+                NOTE: the cache is only cleared by `save_objects`, `log_artifact` and `end_run` of this recorder
+                object. Updates from other recorder objects or processes (e.g. an online updater) are not seen,
+                so please only enable it for artifacts that are not updated elsewhere.
 
         Raises:
             LoadObjectError: if raise some exceptions when load the object
@@ -428,10 +536,19 @@ class MLflowRecorder(Recorder):
         assert self.uri is not None, "Please start the experiment and recorder first before using recorder directly."
 
         path = None
+        loaded = False
         try:
-            path = self.client.download_artifacts(self.id, name)
-            with Path(path).open("rb") as f:
-                data = unpickler(f).load()
+            path = self._artifact_cache.get(name) if use_cache else None
+            if path is None or not os.path.exists(path):
+                path = self.client.download_artifacts(self.id, name)
+            with Path(path).open("rb", buffering=IO_BUFFER_SIZE) as f:
+                # peek the magic prefix without consuming it
+                header = f.peek(len(np.lib.format.MAGIC_PREFIX))
+                if header.startswith(np.lib.format.MAGIC_PREFIX):
+                    data = np.load(f, allow_pickle=False)
+                else:
+                    data = unpickler(f).load()
+            loaded = True
             return data
         except Exception as e:
             raise LoadObjectError(str(e)) from e
@@ -441,28 +558,102 @@ class MLflowRecorder(Recorder):
                 # for saving disk space
                 # For safety, only remove redundant file for specific ArtifactRepository
                 shutil.rmtree(Path(path).absolute().parent)
+            elif use_cache and loaded:
+                self._artifact_cache[name] = path
+                self._artifact_cache.move_to_end(name)
+                if len(self._artifact_cache) > self.ARTIFACT_CACHE_SIZE:
+                    self._artifact_cache.popitem(last=False)
+
+    def _log_batch(self, metrics=(), params=(), tags=()):
+        """
+        Buffer metrics, params and tags and schedule a flush of the buffer.
+
+        The entities are validated before being buffered, because a single invalid entity (e.g. a too long key) makes
+        mlflow reject the whole batch. The invalid ones (including the metrics whose values can't be converted to
+        float) are dropped with a warning instead.
+        """
+        dropped = {}
+        for entity in chain(metrics, params, tags):
+            try:
+                if isinstance(entity, Metric):
+                    entity = Metric(entity.key, float(entity.value), entity.timestamp, entity.step)
+                    _validate_metric(entity.key, entity.value, entity.timestamp, entity.step)
+                elif isinstance(entity, Param):
+                    _validate_param(entity.key, entity.value)
+                else:
+                    _validate_tag(entity.key, entity.value)
+            except (MlflowException, TypeError, ValueError) as e:
+                dropped[entity.key] = str(e)
+                continue
+            self._log_buffer.append(entity)
+        if len(dropped) > 0:
+            logger.warning(f"The following invalid entries are dropped instead of being logged: {dropped}")
+        self._flush_log()
 
     @AsyncCaller.async_dec(ac_attr="async_log")
+    def _flush_log(self):
+        """
+        Send everything in the buffer with `log_batch` so that one request is issued instead of one per key.
+
+        NOTE:
+        - When logging is async, the calls made while the worker is busy are merged into one flush and the
+          following flushes find an empty buffer.
+        - The entities are chunked to respect the batch limits of mlflow.
+        """
+        metrics, param_rounds, tags = [], [], {}
+        while self._log_buffer:
+            entity = self._log_buffer.popleft()
+            if isinstance(entity, Metric):
+                metrics.append(entity)
+            elif isinstance(entity, Param):
+                # mlflow rejects duplicated param keys in a single batch. Identical params are merged and the
+                # conflicting ones are sent in later batches, so mlflow always raises for the conflicts (params are
+                # immutable) no matter how the calls are merged.
+                for params in param_rounds:
+                    if entity.key not in params:
+                        params[entity.key] = entity
+                        break
+                    if params[entity.key].value == entity.value:
+                        break
+                else:
+                    param_rounds.append({entity.key: entity})
+            else:
+                # tags are mutable, so the latest value wins
+                tags[entity.key] = entity
+        tags = list(tags.values())
+        for i in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+            self.client.log_batch(self.id, metrics=metrics[i : i + MAX_METRICS_PER_BATCH])
+        for params in param_rounds:
+            params = list(params.values())
+            for i in range(0, len(params), MAX_PARAMS_TAGS_PER_BATCH):
+                self.client.log_batch(self.id, params=params[i : i + MAX_PARAMS_TAGS_PER_BATCH])
+        for i in range(0, len(tags), MAX_PARAMS_TAGS_PER_BATCH):
+            self.client.log_batch(self.id, tags=tags[i : i + MAX_PARAMS_TAGS_PER_BATCH])
+
     def log_params(self, **kwargs):
-        for name, data in kwargs.items():
-            self.client.log_param(self.id, name, data)
+        self._log_batch(params=[Param(name, str(data)) for name, data in kwargs.items()])
 
-    @AsyncCaller.async_dec(ac_attr="async_log")
     def log_metrics(self, step=None, **kwargs):
-        for name, data in kwargs.items():
-            self.client.log_metric(self.id, name, data, step=step)
+        timestamp = int(time.time() * 1000)
+        self._log_batch(metrics=[Metric(name, data, timestamp, step or 0) for name, data in kwargs.items()])
 
     def log_artifact(self, local_path, artifact_path: Optional[str] = None):
+        self._artifact_cache.clear()
         self.client.log_artifact(self.id, local_path=local_path, artifact_path=artifact_path)
 
-    @AsyncCaller.async_dec(ac_attr="async_log")
     def set_tags(self, **kwargs):
-        for name, data in kwargs.items():
-            self.client.set_tag(self.id, name, data)
+        self._log_batch(tags=[RunTag(name, str(data)) for name, data in kwargs.items()])
 
     def delete_tags(self, *keys):
-        for key in keys:
-            self.client.delete_tag(self.id, key)
+        if len(keys) <= 1:
+            for key in keys:
+                self.client.delete_tag(self.id, key)
+            return
+        # mlflow doesn't provide an API to delete tags in batch, so the requests are sent concurrently
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_REQUEST_WORKERS, len(keys))) as executor:
+            futures = [executor.submit(self.client.delete_tag, self.id, key) for key in keys]
+            for future in futures:
+                future.result()
 
     def get_artifact_uri(self):
         if self.artifact_uri is not None:
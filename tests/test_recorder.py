@@ -0,0 +1,263 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+import unittest
+import concurrent.futures
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import mlflow
+import pickle
+import numpy as np
+from mlflow.exceptions import MlflowException
+
+from qlib.utils.exceptions import LoadObjectError
+from qlib.workflow.recorder import MLflowRecorder
+
+
+class MLflowRecorderTest(unittest.TestCase):
+    """
+    The recorders are created from runs of a sqlite tracking uri whose artifacts are saved in a temporary directory.
+    They are not started, so the logging is not async and can be checked right after the call.
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.TMP_PATH = Path(tempfile.mkdtemp())
+        cls.uri = f"sqlite:///{cls.TMP_PATH / 'mlflow.db'}"
+        cls.client = mlflow.tracking.MlflowClient(tracking_uri=cls.uri)
+        cls.experiment_id = cls.client.create_experiment(
+            "recorder_test", artifact_location=(cls.TMP_PATH / "artifacts").as_uri()
+        )
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        shutil.rmtree(cls.TMP_PATH, ignore_errors=True)
+
+    def setUp(self) -> None:
+        run = self.client.create_run(self.experiment_id, run_name="test")
+        self.recorder = MLflowRecorder(self.experiment_id, self.uri, mlflow_run=run)
+
+    def flush_once(self, *calls):
+        """run the logging calls and flush all of them at once (like what happens when the logging is async)"""
+        with mock.patch.object(MLflowRecorder, "_flush_log"):
+            for call in calls:
+                call()
+        with mock.patch.object(self.recorder.client, "log_batch", wraps=self.recorder.client.log_batch) as log_batch:
+            self.recorder._flush_log()
+        return log_batch.call_count
+
+    def test_log_coalesce(self):
+        n_batch = self.flush_once(
+            *[lambda i=i: self.recorder.log_metrics(step=i, loss=i * 0.1) for i in range(300)],
+            lambda: self.recorder.log_params(lr=0.1),
+            lambda: self.recorder.set_tags(tag="a"),
+            lambda: self.recorder.set_tags(tag="b"),
+        )
+        self.assertEqual(n_batch, 3)
+        self.assertEqual(len(self.client.get_metric_history(self.recorder.id, "loss")), 300)
+        self.assertEqual(self.recorder.list_params()["lr"], "0.1")
+        # tags are mutable, the latest value wins
+        self.assertEqual(self.recorder.list_tags()["tag"], "b")
+
+    def test_log_chunk(self):
+        n_batch = self.flush_once(lambda: self.recorder.log_params(**{f"p{i}": i for i in range(250)}))
+        self.assertEqual(n_batch, 3)
+        self.assertEqual(len(self.recorder.list_params()), 250)
+
+    def test_log_param_conflict(self):
+        # identical params are merged
+        self.flush_once(lambda: self.recorder.log_params(a=1), lambda: self.recorder.log_params(a=1))
+        self.assertEqual(self.recorder.list_params()["a"], "1")
+        # params are immutable, the conflict is raised even if the calls are merged into one flush
+        with self.assertRaises(MlflowException):
+            self.flush_once(lambda: self.recorder.log_params(b=1), lambda: self.recorder.log_params(b=2))
+        self.assertEqual(self.recorder.list_params()["b"], "1")
+
+    def test_log_invalid(self):
+        # the invalid entries are dropped with a warning and the valid ones in the same call are still logged
+        with self.assertLogs(level="WARNING") as logs:
+            self.recorder.log_metrics(ok=1.0, bad=None, nan_str="abc")
+            self.recorder.log_params(**{"p": 1, "x" * 1000: 2})
+            self.recorder.set_tags(**{"t": "a", "y" * 1000: "b"})
+        self.assertIn("bad", logs.output[0])
+        self.assertIn("nan_str", logs.output[0])
+        self.assertEqual(self.recorder.list_metrics(), {"ok": 1.0})
+        self.assertEqual(self.recorder.list_params(), {"p": "1"})
+        self.assertEqual(self.recorder.list_tags()["t"], "a")
+        self.assertNotIn("y" * 1000, self.recorder.list_tags())
+
+    def test_npy_round_trip(self):
+        arr = np.random.rand(3, 4)
+        obj_arr = np.array([{"a": 1}, None], dtype=object)
+        self.recorder.save_objects(**{"arr.npy": arr, "arr.pkl": arr, "obj_arr.npy": obj_arr})
+        # only the arrays named with `.npy` are saved in the npy format
+        with Path(self.recorder.download_artifact("arr.npy")).open("rb") as f:
+            self.assertEqual(f.read(len(np.lib.format.MAGIC_PREFIX)), np.lib.format.MAGIC_PREFIX)
+        np.testing.assert_array_equal(self.recorder.load_object("arr.npy"), arr)
+        with Path(self.recorder.download_artifact("arr.pkl")).open("rb") as f:
+            np.testing.assert_array_equal(pickle.load(f), arr)
+        np.testing.assert_array_equal(self.recorder.load_object("arr.pkl"), arr)
+        # the arrays of objects are pickled and loaded by the given unpickler
+        with Path(self.recorder.download_artifact("obj_arr.npy")).open("rb") as f:
+            self.assertEqual(f.read(1), pickle.PROTO)
+        unpickler = mock.MagicMock(wraps=pickle.Unpickler)
+        self.assertEqual(list(self.recorder.load_object("obj_arr.npy", unpickler=unpickler)), [{"a": 1}, None])
+        unpickler.assert_called_once()
+
+    def test_load_dispatch(self):
+        texts = {
+            "code_cached.txt": "",
+            "code_diff.txt": "diff --git a/x b/x\n",
+            "opcode.txt": "S'abc'\n",
+            "brace.txt": "}\n",
+        }
+        with tempfile.TemporaryDirectory() as local_dir:
+            local_dir = Path(local_dir)
+            with (local_dir / "p0.pkl").open("wb") as f:
+                pickle.dump({"k": 1}, f, protocol=0)
+            for name, text in texts.items():
+                (local_dir / name).write_text(text)
+            self.recorder.save_objects(local_path=str(local_dir))
+        self.recorder.save_objects(p5={"k": 1})
+        self.assertEqual(self.recorder.load_object("p5"), {"k": 1})
+        self.assertEqual(self.recorder.load_object("p0.pkl"), {"k": 1})
+        # the files which are not npy files are always loaded by the unpickler (e.g. the logged text files fail)
+        for name in texts:
+            with self.assertRaises(LoadObjectError):
+                self.recorder.load_object(name)
+
+    def test_save_objects_failure(self):
+        class Unpicklable:
+            def __reduce__(self):
+                raise RuntimeError("can't be pickled")
+
+        self.recorder.save_objects(**{"pred.pkl": {"v": 1}})
+        # a failed overwrite keeps the existing artifact
+        with self.assertRaises(RuntimeError):
+            self.recorder.save_objects(**{"pred.pkl": Unpicklable()})
+        self.assertEqual(self.recorder.load_object("pred.pkl"), {"v": 1})
+        # the objects can't be saved outside the artifact directory
+        with self.assertRaises(MlflowException):
+            self.recorder.save_objects(artifact_path="../../..", **{"escaped.pkl": 1})
+
+    def test_save_objects_pool(self):
+        pool = "concurrent.futures.ThreadPoolExecutor"
+        with mock.patch(pool, wraps=concurrent.futures.ThreadPoolExecutor) as executor:
+            # a single object is uploaded without starting a thread
+            self.recorder.save_objects(a=1)
+            self.recorder.save_objects()
+            executor.assert_not_called()
+            self.recorder.save_objects(b=2, c=3)
+            executor.assert_called_once()
+        self.assertEqual([self.recorder.load_object(name) for name in "abc"], [1, 2, 3])
+
+    def test_delete_tags(self):
+        self.recorder.set_tags(a=1, b=2, c=3, d=4)
+        with mock.patch(
+            "concurrent.futures.ThreadPoolExecutor", wraps=concurrent.futures.ThreadPoolExecutor
+        ) as executor:
+            # a single key is deleted without starting a thread
+            self.recorder.delete_tags("a")
+            self.recorder.delete_tags()
+            executor.assert_not_called()
+            self.recorder.delete_tags("b", "c")
+            executor.assert_called_once()
+        self.assertEqual(
+            {k: v for k, v in self.recorder.list_tags().items() if not k.startswith("mlflow.")}, {"d": "4"}
+        )
+
+    def test_artifact_cache(self):
+        rec = self.recorder
+        rec.save_objects(a=1, b=2)
+        with mock.patch.object(rec.client, "download_artifacts", wraps=rec.client.download_artifacts) as download:
+            # the cache is opt-in
+            rec.load_object("a")
+            rec.load_object("a")
+            self.assertEqual(download.call_count, 2)
+            download.reset_mock()
+
+            self.assertEqual(rec.load_object("a", use_cache=True), 1)
+            self.assertEqual(rec.load_object("a", use_cache=True), 1)
+            self.assertEqual(download.call_count, 1)
+
+            # the cache is cleared when the artifacts are changed by the recorder or the run ends
+            rec.save_objects(a=3)
+            self.assertEqual(rec.load_object("a", use_cache=True), 3)
+            with tempfile.TemporaryDirectory() as local_dir:
+                with (Path(local_dir) / "a").open("wb") as f:
+                    pickle.dump(4, f)
+                rec.log_artifact(str(Path(local_dir) / "a"))
+            self.assertEqual(rec.load_object("a", use_cache=True), 4)
+            rec.load_object("a", use_cache=True)
+            rec.end_run()
+            rec.load_object("a", use_cache=True)
+            self.assertEqual(download.call_count, 4)
+
+        # failed loads are not cached
+        with tempfile.TemporaryDirectory() as local_dir:
+            (Path(local_dir) / "empty").touch()
+            rec.log_artifact(str(Path(local_dir) / "empty"))
+        with self.assertRaises(LoadObjectError):
+            rec.load_object("empty", use_cache=True)
+        self.assertNotIn("empty", rec._artifact_cache)
+
+        # the cache is bounded and the least recently used artifact is dropped
+        with mock.patch.object(MLflowRecorder, "ARTIFACT_CACHE_SIZE", 1):
+            rec.load_object("a", use_cache=True)
+            rec.load_object("b", use_cache=True)
+        self.assertEqual(list(rec._artifact_cache), ["b"])
+
+    def test_pickle(self):
+        self.recorder.set_recorder_name("rname")
+        self.recorder.save_objects(x=1)
+        self.recorder.load_object("x", use_cache=True)
+        with mock.patch.object(MLflowRecorder, "_flush_log"):
+            self.recorder.log_metrics(buffered=1)
+        state = self.recorder.__getstate__()
+        # the buffered logs and the cached downloads are not pickled
+        self.assertNotIn("_log_buffer", state)
+        self.assertNotIn("_artifact_cache", state)
+        rec = pickle.loads(pickle.dumps(self.recorder))
+        self.assertEqual(len(rec._log_buffer), 0)
+        self.assertEqual(len(rec._artifact_cache), 0)
+        self.recorder._log_buffer.clear()
+        self.assertEqual(rec, self.recorder)
+        self.assertEqual(rec.info, self.recorder.info)
+        self.assertEqual(rec.recorder_name, "rname")
+        rec.log_metrics(m=1)
+        self.assertEqual(self.recorder.list_metrics(), {"m": 1.0})
+
+    def test_unpickle_legacy(self):
+        # the state of a recorder pickled before `__slots__` was introduced is its `__dict__`
+        state = {
+            "id": self.recorder.id,
+            "name": "test",
+            "experiment_id": self.experiment_id,
+            "start_time": None,
+            "end_time": None,
+            "status": MLflowRecorder.STATUS_R,
+            "_uri": self.uri,
+            "_artifact_uri": None,
+            "client": self.recorder.client,
+            "async_log": None,
+            "extra": "attribute set by users",
+        }
+
+        # the same opcodes as `pickle.dumps(recorder, protocol=2)` of a recorder with `__dict__`:
+        # PROTO, GLOBAL of the class, EMPTY_TUPLE, NEWOBJ, the state, BUILD and STOP
+        state_payload = pickle.dumps(state, protocol=2)[2:-1]
+        legacy = b"\x80\x02cqlib.workflow.recorder\nMLflowRecorder\n)\x81" + state_payload + b"b."
+        with self.assertLogs(level="WARNING"):
+            rec = pickle.loads(legacy)
+        self.assertIsInstance(rec, MLflowRecorder)
+        self.assertEqual(rec, self.recorder)
+        self.assertEqual(rec.status, MLflowRecorder.STATUS_R)
+        self.assertFalse(hasattr(rec, "extra"))
+        rec.log_metrics(m=1)
+        self.assertEqual(rec.list_metrics(), {"m": 1.0})
+
+
+if __name__ == "__main__":
+    unittest.main()